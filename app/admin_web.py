@@ -49,6 +49,7 @@ from .store import MemoryStore
 from .rules import reply_for, detect_intents
 from .lead_logger import ensure_first_contact, mark_intent, save_handoff_lead, get_agent_by_instance
 from .rules_engine import invalidate_agent_rules
+from .portal_web import set_portal_token
 
 try:
     from zoneinfo import ZoneInfo
@@ -524,6 +525,10 @@ async def clients_generate_token(req: Request, client_id: str):
         if err_resp:
             return err_resp
 
+    # sobrescreve o cache do portal com o token novo: o antigo para de valer na hora
+    # (se o Redis falhar aqui, o antigo ainda pode valer até PORTAL_TOKEN_CACHE_TTL_SECONDS)
+    await set_portal_token(client_id, token)
+
     return _redirect(req, "admin_web_clients", flash_kind="success", flash_message=f"Token gerado para {client_id}: {token}")
 
 
@@ -12,6 +12,7 @@ from starlette.templating import Jinja2Templates
 from sqlalchemy import select, func, desc
 from .db import SessionLocal
 from .models import Client, Agent, Lead
+from .utils.security import token_matches
 
 logger = logging.getLogger("agent")
 
@@ -51,7 +52,8 @@ def _require_client(req: Request) -> Client:
 
     with SessionLocal() as db:
         c = db.execute(select(Client).where(Client.id == client_id).limit(1)).scalar_one_or_none()
-        if not c or not (c.login_token or "").strip() or (c.login_token or "").strip() != token:
+        db_token = (c.login_token or "").strip() if c else ""
+        if not db_token or not token_matches(db_token, token):
             raise PermissionError("unauthorized")
 
         try:
@@ -81,7 +83,8 @@ async def portal_login_post(req: Request, client_id: str = Form(""), token: str
 
     with SessionLocal() as db:
         c = db.execute(select(Client).where(Client.id == client_id).limit(1)).scalar_one_or_none()
-        if not c or (c.login_token or "").strip() != token:
+        db_token = (c.login_token or "").strip() if c else ""
+        if not db_token or not token_matches(db_token, token):
             return _redirect(req, "portal_login", flash_kind="error", flash_message="Client ID ou token inválidos.")
 
     resp = _redirect(req, "portal_dashboard", flash_kind="success", flash_message="Login realizado.")
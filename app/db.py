@@ -1,8 +1,14 @@
 import os
+import logging
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy import select
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+logger = logging.getLogger("agent")
 
 class Base(DeclarativeBase):
     pass
@@ -19,3 +25,44 @@ engine = create_engine(
 )
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Async (asyncpg) — usado pelas rotas async (portal) para não bloquear o event loop.
+# Por padrão deriva do DATABASE_URL trocando o driver; ASYNC_DATABASE_URL sobrescreve.
+# asyncpg não aceita opções libpq na query string: sslmode vira ssl; as demais são
+# ignoradas com warning (nunca derruba o start do serviço) — para usá-las no portal,
+# defina ASYNC_DATABASE_URL.
+_LIBPQ_TO_ASYNCPG = {"sslmode": "ssl"}
+
+
+def _async_url_from(sync_url: str):
+    url = make_url(sync_url)
+    query = {}
+    dropped = []
+    for k, v in url.query.items():
+        if k in _LIBPQ_TO_ASYNCPG:
+            query[_LIBPQ_TO_ASYNCPG[k]] = v
+        else:
+            dropped.append(k)
+    if dropped:
+        logger.warning(
+            "ASYNC_DATABASE_URL: ignorando opções do DATABASE_URL não suportadas pelo asyncpg: %s "
+            "(defina ASYNC_DATABASE_URL para configurá-las)",
+            ", ".join(sorted(dropped)),
+        )
+    return url.set(drivername="postgresql+asyncpg", query=query)
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", "").strip() or _async_url_from(DATABASE_URL)
+
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    poolclass=AsyncAdaptedQueuePool,
+    pool_pre_ping=True,
+    # pool próprio (separado do sync): conexões por worker = DB_POOL_SIZE + DB_MAX_OVERFLOW
+    # + ASYNC_DB_POOL_SIZE + ASYNC_DB_MAX_OVERFLOW
+    pool_size=int(os.getenv("ASYNC_DB_POOL_SIZE", "5")),
+    max_overflow=int(os.getenv("ASYNC_DB_MAX_OVERFLOW", "5")),
+    pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+)
+
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
@@ -3,7 +3,7 @@ import time
 import logging
 import httpx
 from fastapi import FastAPI, Request, BackgroundTasks
-from fastapi.responses import Response
+from fastapi.responses import Response, ORJSONResponse
 
 from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 
@@ -26,17 +26,18 @@ from .metrics import (
     WEBHOOK_LATENCY,
 )
 
-from .ratelimit import RateLimiter
+from .ratelimit import RedisRateLimiter
 from .admin import router as admin_router
 from .integration import router as integration_router
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("agent")
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 evo = EvolutionClient()
 store = MemoryStore()
-rl = RateLimiter(max_events=10, window_seconds=12)
+# ainda não aplicado no webhook (rl.allow não é chamado); allow() é async => usar com await
+rl = RedisRateLimiter(max_events=10, window_seconds=12)
 
 # Incluindo os roteadores com seus prefixos corretos
 app.include_router(admin_router)
@@ -99,6 +100,7 @@ def extract_payload(payload: dict):
 @app.post("/webhook")
 async def webhook(req: Request, background_tasks: BackgroundTasks):
     start = time.time()
+    now = int(start)
     WEBHOOK_RECEIVED.inc()
     try:
         payload = await req.json()
@@ -120,7 +122,7 @@ async def webhook(req: Request, background_tasks: BackgroundTasks):
         return {"ok": True}
 
     # PASSO 3: Bloquear mensagens após CLOSED (Check de Pausa)
-    if store.is_paused(number):
+    if store.is_paused(number, now):
         logger.info(f"[SETTLEMENT_LOG] BOT_PAUSED: Ignoring number={number}")
         return {"ok": True}
 
@@ -148,7 +150,7 @@ async def webhook(req: Request, background_tasks: BackgroundTasks):
                 logger.error(f"[EVOLUTION_LOG] Failed to send final message: {e}")
             
             # Somente AGORA limpamos e pausamos
-            store.set_paused(number, 31536000)
+            store.set_paused(number, 31536000, now)
             state.clear()
             store.save_state(number, state)
         else:
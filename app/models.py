@@ -1,7 +1,7 @@
 # app/models.py
 from __future__ import annotations
 
-from sqlalchemy import Column, Text, TIMESTAMP, ForeignKey, Integer, BigInteger, Boolean
+from sqlalchemy import Column, Text, TIMESTAMP, ForeignKey, Integer, BigInteger, Boolean, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import JSONB
@@ -63,6 +63,11 @@ class Agent(Base):
 
     client = relationship("Client", lazy="joined")
 
+    # portal: agents do client ordenados por created_at desc
+    __table_args__ = (
+        Index("idx_agents_client_created", client_id, created_at.desc()),
+    )
+
 
 class Lead(Base):
     __tablename__ = "leads"
@@ -91,6 +96,14 @@ class Lead(Base):
     updated_at = Column(TIMESTAMP(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
     created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
 
+    # portal: contagem por agente (GROUP BY agent_id).
+    # listagem por client usa idx_leads_client_created (já criado em sql_leads_migration.sql);
+    # a busca (ILIKE) usa índices trigram criados via sql_leads_search_trgm_migration.sql
+    # (dependem da extensão pg_trgm, por isso ficam fora do create_all)
+    __table_args__ = (
+        Index("idx_leads_client_agent", client_id, agent_id),
+    )
+
 
 class AgentCheck(Base):
     """
@@ -95,7 +95,9 @@ async def _check_one(agent: Agent, client: httpx.AsyncClient) -> Dict[str, Any]:
 
     t0 = time.time()
     try:
-        r = await client.get(url, headers=headers)
+        # client sem timeout próprio: um único deadline por request (asyncio.timeout)
+        async with asyncio.timeout(MONITOR_TIMEOUT_SECONDS):
+            r = await client.get(url, headers=headers)
         ms = int(round((time.time() - t0) * 1000))
 
         details: Dict[str, Any] = {
@@ -144,7 +146,7 @@ async def _check_one(agent: Agent, client: httpx.AsyncClient) -> Dict[str, Any]:
 
     except Exception as e:
         ms = int(round((time.time() - t0) * 1000))
-        err = str(e)
+        err = str(e) or type(e).__name__
         if len(err) > 300:
             err = err[:300] + "..."
         return {
@@ -201,7 +203,8 @@ async def monitor_loop() -> None:
 
     limits = httpx.Limits(max_keepalive_connections=20, max_connections=50)
 
-    async with httpx.AsyncClient(timeout=MONITOR_TIMEOUT_SECONDS, limits=limits) as client:
+    # timeout aplicado por request em _check_one (asyncio.timeout)
+    async with httpx.AsyncClient(timeout=None, limits=limits) as client:
         while True:
             try:
                 with SessionLocal() as db:
@@ -27,35 +27,102 @@ from __future__ import annotations
 
 import os
 import csv
-import io
 import logging
+from functools import lru_cache
+from urllib.parse import urlencode
 from datetime import datetime, timezone, timedelta
 from zoneinfo import ZoneInfo
 from typing import Optional, Any
 
 from fastapi import APIRouter, Request, Form
-from fastapi.responses import RedirectResponse, StreamingResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
+from starlette.datastructures import URLPath
 from starlette.templating import Jinja2Templates
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, Template
 
-from sqlalchemy import select, func, desc, or_
+from sqlalchemy import RowMapping, select, func, desc, or_, and_, bindparam, cast, literal, null, union_all, BigInteger
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from .db import SessionLocal
+from .db import AsyncSessionLocal
+from .redis_client import get_redis
+from .utils.security import token_matches
 from .models import Client, Agent, Lead
 
 logger = logging.getLogger("agent")
 
-templates = Jinja2Templates(directory=os.path.join(os.path.dirname(__file__), "templates"))
+# auto_reload só em DEV (ENV=dev); em produção os templates são resolvidos uma vez no import
+_TEMPLATES_AUTO_RELOAD = os.getenv("ENV", "").strip().lower() == "dev"
+
+# bytecode cache em disco: workers novos (e reloads em DEV) pulam a compilação dos templates.
+# JINJA_CACHE_DIR vazio => diretório temporário padrão do Jinja
+_JINJA_CACHE_DIR = os.getenv("JINJA_CACHE_DIR", "").strip() or None
+if _JINJA_CACHE_DIR:
+    os.makedirs(_JINJA_CACHE_DIR, exist_ok=True)
+
+templates = Jinja2Templates(
+    env=Environment(
+        loader=FileSystemLoader(os.path.join(os.path.dirname(__file__), "templates")),
+        autoescape=True,
+        auto_reload=_TEMPLATES_AUTO_RELOAD,
+        bytecode_cache=FileSystemBytecodeCache(_JINJA_CACHE_DIR),
+    )
+)
 router = APIRouter(prefix="/portal", tags=["portal_web"])
 
+_TPL_LOGIN = templates.get_template("portal_login.html")
+_TPL_DASH = templates.get_template("portal_dashboard.html")
+_TPL_AGENTS = templates.get_template("portal_agents.html")
+_TPL_LEADS = templates.get_template("portal_leads.html")
+
 BR_TZ = ZoneInfo(os.getenv("APP_TIMEZONE", "America/Sao_Paulo"))
 ONLINE_WINDOW_SECONDS = int(os.getenv("AGENT_ONLINE_WINDOW_SECONDS", "300"))  # 5 min
+PORTAL_SESSION_MAX_AGE = 60 * 60 * 12  # 12h (cookies do portal)
+# cache do token no Redis: curto, para refletir troca de token sem depender de invalidação
+PORTAL_TOKEN_CACHE_TTL_SECONDS = int(os.getenv("PORTAL_TOKEN_CACHE_TTL_SECONDS", "300"))
+CSV_CHUNK_ROWS = 500  # linhas por chunk no export CSV
 
 
 # -----------------------------------------------------------------------------
 # Helpers
 # -----------------------------------------------------------------------------
+# rotas do portal não têm path params: o path resolvido é memoizado por nome
+# (evita varrer a tabela de rotas a cada redirect / login_action)
+_URL_PATHS: dict[str, URLPath] = {}
+
+
 def _url(req: Request, name: str, **path_params: Any) -> str:
-    return str(req.url_for(name, **path_params))
+    if path_params:
+        return str(req.url_for(name, **path_params))
+    path = _URL_PATHS.get(name)
+    if path is None:
+        provider = req.scope.get("router") or req.scope.get("app")
+        path = _URL_PATHS[name] = provider.url_path_for(name)
+    return str(path.make_absolute_url(base_url=req.base_url))
+
+
+def _render(tpl: Template, ctx: dict) -> HTMLResponse:
+    if _TEMPLATES_AUTO_RELOAD:
+        tpl = templates.get_template(tpl.name)
+    return HTMLResponse(tpl.render(ctx))
+
+
+class _CsvChunks:
+    """
+    Destino do csv.writer: acumula as linhas numa lista e devolve em bytes por chunk
+    (sem StringIO intermediário).
+    """
+    __slots__ = ("buf",)
+
+    def __init__(self) -> None:
+        self.buf: list[str] = []
+
+    def write(self, s: str) -> None:
+        self.buf.append(s)
+
+    def flush(self) -> bytes:
+        data = "".join(self.buf).encode("utf-8")
+        self.buf.clear()
+        return data
 
 
 def _flash_from_query(req: Request) -> Optional[dict]:
@@ -89,8 +156,6 @@ def _redirect(
             qp[str(k)] = str(v)
 
     if qp:
-        from urllib.parse import urlencode
-
         sep = "&" if "?" in url else "?"
         url = f"{url}{sep}{urlencode(qp)}"
 
@@ -122,10 +187,44 @@ def _is_agent_online(last_seen_at: Any) -> bool:
     return (now - d) <= timedelta(seconds=ONLINE_WINDOW_SECONDS)
 
 
-def _require_client(req: Request) -> str:
+def _token_cache_key(client_id: str) -> str:
+    return f"ptoken:{client_id}"
+
+
+async def _cache_portal_token(client_id: str, token: str) -> None:
+    """
+    Recarrega o cache a partir de um token lido do DB.
+    SET NX: se o admin trocou o token nesse meio tempo (set_portal_token), a escrita
+    atrasada com o token antigo não sobrescreve o novo.
+    """
+    r = get_redis()
+    if r is None:
+        return
+    try:
+        await r.set(_token_cache_key(client_id), token, ex=PORTAL_TOKEN_CACHE_TTL_SECONDS, nx=True)
+    except Exception as e:
+        logger.warning("PORTAL_TOKEN_CACHE_SET_ERROR: %s", e)
+
+
+async def set_portal_token(client_id: str, token: str) -> None:
+    """
+    Chamado pelo admin ao gerar um token novo: grava o token atual no cache (sobrescreve),
+    assim o antigo deixa de bater no Redis na hora.
+    """
+    r = get_redis()
+    if r is None:
+        return
+    try:
+        await r.set(_token_cache_key(client_id), token, ex=PORTAL_TOKEN_CACHE_TTL_SECONDS)
+    except Exception as e:
+        logger.warning("PORTAL_TOKEN_CACHE_SET_ERROR: %s", e)
+
+
+async def _require_client(req: Request) -> str:
     """
     Auth do portal:
     - cookie client_id + client_token
+    - token conferido primeiro no Redis (ptoken:{client_id}); miss => DB e recarrega o cache
     """
     client_id = (req.cookies.get("client_id") or "").strip()
     token = (req.cookies.get("client_token") or "").strip()
@@ -133,68 +232,102 @@ def _require_client(req: Request) -> str:
     if not client_id or not token:
         raise PermissionError("unauthorized")
 
-    with SessionLocal() as db:
-        c = db.execute(select(Client).where(Client.id == client_id).limit(1)).scalar_one_or_none()
-        if not c:
-            raise PermissionError("unauthorized")
-
-        db_token = (getattr(c, "login_token", None) or "").strip()
-        if not db_token or db_token != token:
-            raise PermissionError("unauthorized")
+    r = get_redis()
+    if r is not None:
+        try:
+            cached = await r.get(_token_cache_key(client_id))
+            if cached and token_matches(cached, token):
+                return client_id
+        except Exception as e:
+            logger.warning("PORTAL_TOKEN_CACHE_GET_ERROR: %s", e)
+
+    async with AsyncSessionLocal() as db:
+        # só a coluna do token (None também quando o client não existe)
+        db_token = (await db.execute(
+            select(Client.login_token).where(Client.id == client_id).limit(1)
+        )).scalar_one_or_none()
+
+    db_token = (db_token or "").strip()
+    if not db_token or not token_matches(db_token, token):
+        raise PermissionError("unauthorized")
 
+    await _cache_portal_token(client_id, token)
     return client_id
 
 
-def _client_to_view(c: Client) -> dict:
-    return {
-        "id": getattr(c, "id", None),
-        "name": getattr(c, "name", None),
-        "plan": getattr(c, "plan", None),
-    }
-
-
-def _agent_to_view(a: Agent) -> dict:
-    last_seen_raw = getattr(a, "last_seen_at", None)
-    return {
-        "id": getattr(a, "id", None),
-        "client_id": getattr(a, "client_id", None),
-        "name": getattr(a, "name", None),
-        "instance": getattr(a, "instance", None),
-        "status": getattr(a, "status", None),
-        "online": _is_agent_online(last_seen_raw),
-        "last_seen_at": _fmt_dt_br(last_seen_raw) or None,
-        "created_at": _fmt_dt_br(getattr(a, "created_at", None)) or None,
-    }
+# colunas usadas pelas views (páginas são read-only: linhas em vez de entidades ORM)
+_CLIENT_VIEW_COLS = (Client.id, Client.name, Client.plan)
+
+_AGENT_VIEW_COLS = (
+    Agent.id,
+    Agent.client_id,
+    Agent.name,
+    Agent.instance,
+    Agent.status,
+    Agent.last_seen_at,
+    Agent.created_at,
+)
+
+_LEAD_VIEW_COLS = (
+    Lead.id,
+    Lead.client_id,
+    Lead.agent_id,
+    Lead.instance,
+    Lead.from_number,
+    Lead.nome,
+    Lead.telefone,
+    Lead.assunto,
+    Lead.status,
+    Lead.intent_detected,
+    Lead.created_at,
+)
+
+
+# chaves de uma linha de _select_leads_view()
+_LEAD_VIEW_KEYS = tuple(c.key for c in _LEAD_VIEW_COLS) + ("agent_name",)
+
+
+def _agent_to_view(m: RowMapping) -> dict:
+    v = dict(m)
+    v["online"] = _is_agent_online(m["last_seen_at"])
+    v["last_seen_at"] = _fmt_dt_br(m["last_seen_at"]) or None
+    v["created_at"] = _fmt_dt_br(m["created_at"]) or None
+    return v
+
+
+def _select_leads_view():
+    # LEFT JOIN traz o nome do agente na própria linha (sem montar agents_map em Python).
+    # Mesmo resultado do agents_map: só agentes do próprio client; nome vazio => id do agente.
+    return (
+        select(
+            *_LEAD_VIEW_COLS,
+            func.coalesce(func.nullif(Agent.name, ""), Agent.id).label("agent_name"),
+        )
+        .select_from(Lead)
+        .outerjoin(Agent, and_(Agent.id == Lead.agent_id, Agent.client_id == Lead.client_id))
+    )
 
 
-def _lead_to_view(l: Lead, agent_name: Optional[str] = None) -> dict:
-    return {
-        "id": getattr(l, "id", None),
-        "client_id": getattr(l, "client_id", None),
-        "agent_id": getattr(l, "agent_id", None),
-        "agent_name": agent_name,
-        "instance": getattr(l, "instance", None),
-        "from_number": getattr(l, "from_number", None),
-        "nome": getattr(l, "nome", None),
-        "telefone": getattr(l, "telefone", None),
-        "assunto": getattr(l, "assunto", None),
-        "status": getattr(l, "status", None),
-        "intent_detected": getattr(l, "intent_detected", None),
-        "created_at": _fmt_dt_br(getattr(l, "created_at", None)) or None,
-    }
+def _lead_to_view(m: RowMapping) -> dict:
+    # as chaves da view são as próprias colunas de _LEAD_VIEW_COLS + agent_name
+    v = dict(m)
+    v["created_at"] = _fmt_dt_br(m["created_at"]) or None
+    return v
 
 
-def _build_portal_leads_stmt(client_id: str, q: str = "", agent_id: str = "", limit: int = 200):
-    q = (q or "").strip()
-    agent_id = (agent_id or "").strip()
+@lru_cache(maxsize=4)
+def _portal_leads_stmt(has_q: bool, has_agent: bool):
+    """
+    Statement parametrizado por "formato" de filtro (com/sem busca, com/sem agente).
+    Os valores entram via bindparam, então o mesmo objeto é reutilizado entre requests.
+    """
+    stmt = _select_leads_view().where(Lead.client_id == bindparam("client_id"))
 
-    stmt = select(Lead).where(Lead.client_id == client_id)
+    if has_agent:
+        stmt = stmt.where(Lead.agent_id == bindparam("aid"))
 
-    if agent_id:
-        stmt = stmt.where(Lead.agent_id == agent_id)
-
-    if q:
-        like = f"%{q}%"
+    if has_q:
+        like = bindparam("like")
         stmt = stmt.where(
             or_(
                 Lead.from_number.ilike(like),
@@ -206,8 +339,84 @@ def _build_portal_leads_stmt(client_id: str, q: str = "", agent_id: str = "", li
             )
         )
 
-    stmt = stmt.order_by(desc(Lead.created_at)).limit(limit)
-    return stmt
+    return stmt.order_by(desc(Lead.created_at)).limit(bindparam("lim"))
+
+
+def _build_portal_leads_stmt(client_id: str, q: str = "", agent_id: str = "", limit: int = 200):
+    q = (q or "").strip()
+    agent_id = (agent_id or "").strip()
+
+    params: dict[str, Any] = {"client_id": client_id, "lim": limit}
+    if agent_id:
+        params["aid"] = agent_id
+    if q:
+        params["like"] = f"%{q}%"
+
+    return _portal_leads_stmt(bool(q), bool(agent_id)).params(**params)
+
+
+# -----------------------------------------------------------------------------
+# Queries (recebem a sessão: o dashboard faz tudo numa conexão só)
+# -----------------------------------------------------------------------------
+async def _select_client_and_agents(db: AsyncSession, client_id: str) -> tuple[dict, list]:
+    client = (await db.execute(
+        select(*_CLIENT_VIEW_COLS).where(Client.id == client_id).limit(1)
+    )).mappings().first()
+    client_view = dict(client) if client else {"id": client_id, "name": client_id, "plan": ""}
+
+    agents = (await db.execute(
+        select(*_AGENT_VIEW_COLS).where(Agent.client_id == client_id).order_by(desc(Agent.created_at))
+    )).mappings().all()
+    return client_view, agents
+
+
+async def _fetch_client_and_agents(client_id: str) -> tuple[dict, list]:
+    async with AsyncSessionLocal() as db:
+        return await _select_client_and_agents(db, client_id)
+
+
+def _dashboard_leads_stmt(client_id: str, limit: int = 10):
+    """
+    Contagem por agente + últimos leads numa ida só ao banco (UNION ALL com discriminador `kind`):
+    - kind="count": agent_id + cnt (1 linha por agent_id, inclui NULL); demais colunas NULL
+    - kind="recent": colunas da view de leads, mais novos primeiro; cnt NULL
+    """
+    recent = (
+        _select_leads_view()
+        .add_columns(literal("recent").label("kind"), cast(null(), BigInteger).label("cnt"))
+        .where(Lead.client_id == client_id)
+        .order_by(desc(Lead.created_at))
+        .limit(limit)
+        .subquery()
+    )
+
+    # mesmas colunas/ordem do ramo recent; NULLs tipados (no Postgres, NULL sem tipo em subquery vira text)
+    count_cols = [c if c is Lead.agent_id else cast(null(), c.type).label(c.key) for c in _LEAD_VIEW_COLS]
+    counts = (
+        select(
+            *count_cols,
+            cast(null(), Agent.name.type).label("agent_name"),
+            literal("count").label("kind"),
+            func.count().label("cnt"),
+        )
+        .where(Lead.client_id == client_id)
+        .group_by(Lead.agent_id)
+    )
+
+    u = union_all(select(recent), counts).subquery()
+    # UNION ALL não garante ordem: reaplica a dos recentes por fora
+    return select(u).order_by(u.c.kind, desc(u.c.created_at))
+
+
+async def _select_dashboard_leads(db: AsyncSession, client_id: str, limit: int = 10) -> tuple[list, list]:
+    per_agent_rows = []
+    recent = []
+    for m in (await db.execute(_dashboard_leads_stmt(client_id, limit))).mappings():
+        if m["kind"] == "count":
+            per_agent_rows.append((m["agent_id"], m["cnt"]))
+        else:
+            recent.append({k: m[k] for k in _LEAD_VIEW_KEYS})
+    return per_agent_rows, recent
 
 
 # -----------------------------------------------------------------------------
@@ -221,7 +430,7 @@ async def portal_login_page(req: Request):
         "flash": flash,
         "login_action": _url(req, "portal_login_post"),
     }
-    return templates.TemplateResponse("portal_login.html", ctx)
+    return _render(_TPL_LOGIN, ctx)
 
 
 @router.post("/login", name="portal_login_post")
@@ -232,27 +441,29 @@ async def portal_login_post(req: Request, client_id: str = Form(""), token: str
     if not client_id or not token:
         return _redirect(req, "portal_login", flash_kind="error", flash_message="Informe client_id e token.")
 
-    with SessionLocal() as db:
-        c = db.execute(select(Client).where(Client.id == client_id).limit(1)).scalar_one_or_none()
+    async with AsyncSessionLocal() as db:
+        c = (await db.execute(select(Client).where(Client.id == client_id).limit(1))).scalar_one_or_none()
         if not c:
             return _redirect(req, "portal_login", flash_kind="error", flash_message="Client não encontrado.")
 
         db_token = (getattr(c, "login_token", None) or "").strip()
         if not db_token:
             return _redirect(req, "portal_login", flash_kind="error", flash_message="Client sem token. Peça ao admin gerar.")
-        if db_token != token:
+        if not token_matches(db_token, token):
             return _redirect(req, "portal_login", flash_kind="error", flash_message="Token inválido.")
 
         # marca last used (best effort)
         try:
             c.login_token_last_used_at = func.now()
             db.add(c)
-            db.commit()
+            await db.commit()
         except Exception:
             pass
 
         client_name = getattr(c, "name", None) or client_id
 
+    await _cache_portal_token(client_id, token)
+
     resp = _redirect(req, "portal_dashboard", flash_kind="success", flash_message=f"Bem-vindo(a), {client_name}!")
 
     # cookie do portal (separado do admin)
@@ -262,7 +473,7 @@ async def portal_login_post(req: Request, client_id: str = Form(""), token: str
         httponly=True,
         secure=True,
         samesite="lax",
-        max_age=60 * 60 * 12,  # 12h
+        max_age=PORTAL_SESSION_MAX_AGE,
     )
     resp.set_cookie(
         key="client_token",
@@ -270,7 +481,7 @@ async def portal_login_post(req: Request, client_id: str = Form(""), token: str
         httponly=True,
         secure=True,
         samesite="lax",
-        max_age=60 * 60 * 12,  # 12h
+        max_age=PORTAL_SESSION_MAX_AGE,
     )
     return resp
 
@@ -289,90 +500,61 @@ async def portal_logout(req: Request):
 @router.get("", name="portal_dashboard")
 async def portal_dashboard(req: Request):
     try:
-        client_id = _require_client(req)
+        client_id = await _require_client(req)
     except PermissionError:
         return _redirect(req, "portal_login", flash_kind="error", flash_message="Faça login para acessar.")
 
     flash = _flash_from_query(req)
 
-    with SessionLocal() as db:
-        client = db.execute(select(Client).where(Client.id == client_id).limit(1)).scalar_one_or_none()
-        client_view = _client_to_view(client) if client else {"id": client_id, "name": client_id, "plan": ""}
-
-        total_leads = db.execute(
-            select(func.count()).select_from(Lead).where(Lead.client_id == client_id)
-        ).scalar_one()
-
-        agents = db.execute(
-            select(Agent).where(Agent.client_id == client_id).order_by(desc(Agent.created_at))
-        ).scalars().all()
-
-        agents_map = {str(a.id): str(getattr(a, "name", "") or a.id) for a in agents}
-        agent_ids = [a.id for a in agents]
-
-        per_agent_rows = []
-        if agent_ids:
-            per_agent_rows = db.execute(
-                select(Lead.agent_id, func.count().label("cnt"))
-                .where(Lead.client_id == client_id)
-                .group_by(Lead.agent_id)
-            ).all()
-
-        per_agent = []
-        null_cnt = db.execute(
-            select(func.count()).select_from(Lead).where(Lead.client_id == client_id, Lead.agent_id.is_(None))
-        ).scalar_one()
-        if null_cnt:
-            per_agent.append({"agent_id": None, "agent_name": "— (sem agente)", "count": int(null_cnt)})
-
-        for agent_id_val, cnt in per_agent_rows:
-            if agent_id_val is None:
-                continue
-            per_agent.append({
-                "agent_id": str(agent_id_val),
-                "agent_name": agents_map.get(str(agent_id_val), str(agent_id_val)),
-                "count": int(cnt or 0),
-            })
-
-        per_agent.sort(key=lambda x: x["count"], reverse=True)
-
-        recent = db.execute(
-            select(Lead).where(Lead.client_id == client_id).order_by(desc(Lead.created_at)).limit(10)
-        ).scalars().all()
-
-        recent_view = [
-            _lead_to_view(l, agent_name=agents_map.get(str(getattr(l, "agent_id", "") or "")))
-            for l in recent
-        ]
+    # 1 conexão do pool por dashboard; contagens + recentes vêm numa query só
+    async with AsyncSessionLocal() as db:
+        client_view, agents = await _select_client_and_agents(db, client_id)
+        per_agent_rows, recent = await _select_dashboard_leads(db, client_id, limit=10)
+
+    agents_map = {str(a["id"]): str(a["name"] or a["id"]) for a in agents}
+
+    # 1 linha por agent_id (inclui NULL); total = soma
+    total_leads = 0
+    per_agent = []
+    for agent_id_val, cnt in per_agent_rows:
+        cnt = int(cnt or 0)
+        total_leads += cnt
+        if agent_id_val is None:
+            if cnt:
+                per_agent.append({"agent_id": None, "agent_name": "— (sem agente)", "count": cnt})
+            continue
+        per_agent.append({
+            "agent_id": str(agent_id_val),
+            "agent_name": agents_map.get(str(agent_id_val), str(agent_id_val)),
+            "count": cnt,
+        })
+
+    per_agent.sort(key=lambda x: x["count"], reverse=True)
+
+    recent_view = [_lead_to_view(l) for l in recent]
 
     ctx = {
         "request": req,
         "flash": flash,
         "active_nav": "dashboard",
         "client": client_view,
-        "stats": {"total_leads": int(total_leads or 0), "agents_count": len(agents)},
+        "stats": {"total_leads": total_leads, "agents_count": len(agents)},
         "per_agent": per_agent,
         "recent_leads": recent_view,
     }
-    return templates.TemplateResponse("portal_dashboard.html", ctx)
+    return _render(_TPL_DASH, ctx)
 
 
 @router.get("/agents", name="portal_agents")
 async def portal_agents(req: Request):
     try:
-        client_id = _require_client(req)
+        client_id = await _require_client(req)
     except PermissionError:
         return _redirect(req, "portal_login", flash_kind="error", flash_message="Faça login para acessar.")
 
     flash = _flash_from_query(req)
 
-    with SessionLocal() as db:
-        client = db.execute(select(Client).where(Client.id == client_id).limit(1)).scalar_one_or_none()
-        client_view = _client_to_view(client) if client else {"id": client_id, "name": client_id, "plan": ""}
-
-        agents = db.execute(
-            select(Agent).where(Agent.client_id == client_id).order_by(desc(Agent.created_at))
-        ).scalars().all()
+    client_view, agents = await _fetch_client_and_agents(client_id)
 
     ctx = {
         "request": req,
@@ -381,13 +563,13 @@ async def portal_agents(req: Request):
         "client": client_view,
         "agents": [_agent_to_view(a) for a in agents],
     }
-    return templates.TemplateResponse("portal_agents.html", ctx)
+    return _render(_TPL_AGENTS, ctx)
 
 
 @router.get("/leads", name="portal_leads")
 async def portal_leads(req: Request, q: str = "", agent_id: str = ""):
     try:
-        client_id = _require_client(req)
+        client_id = await _require_client(req)
     except PermissionError:
         return _redirect(req, "portal_login", flash_kind="error", flash_message="Faça login para acessar.")
 
@@ -395,22 +577,13 @@ async def portal_leads(req: Request, q: str = "", agent_id: str = ""):
     q = (q or "").strip()
     agent_id = (agent_id or "").strip()
 
-    with SessionLocal() as db:
-        client = db.execute(select(Client).where(Client.id == client_id).limit(1)).scalar_one_or_none()
-        client_view = _client_to_view(client) if client else {"id": client_id, "name": client_id, "plan": ""}
-
-        agents = db.execute(
-            select(Agent).where(Agent.client_id == client_id).order_by(desc(Agent.created_at))
-        ).scalars().all()
-        agents_map = {str(a.id): str(getattr(a, "name", "") or a.id) for a in agents}
+    async with AsyncSessionLocal() as db:
+        client_view, agents = await _select_client_and_agents(db, client_id)
 
         stmt = _build_portal_leads_stmt(client_id=client_id, q=q, agent_id=agent_id, limit=200)
-        leads = db.execute(stmt).scalars().all()
+        leads = (await db.execute(stmt)).mappings().all()
 
-        leads_view = [
-            _lead_to_view(l, agent_name=agents_map.get(str(getattr(l, "agent_id", "") or "")))
-            for l in leads
-        ]
+        leads_view = [_lead_to_view(l) for l in leads]
 
     ctx = {
         "request": req,
@@ -419,11 +592,11 @@ async def portal_leads(req: Request, q: str = "", agent_id: str = ""):
         "client": client_view,
         "q": q,
         "agent_id": agent_id,
-        "agents": [{"id": str(a.id), "name": str(getattr(a, "name", "") or a.id)} for a in agents],
+        "agents": [{"id": str(a["id"]), "name": str(a["name"] or a["id"])} for a in agents],
         "leads": leads_view,
         "export_csv_url": _url(req, "portal_leads_export_csv"),  # pra você usar no template
     }
-    return templates.TemplateResponse("portal_leads.html", ctx)
+    return _render(_TPL_LEADS, ctx)
 
 
 # -----------------------------------------------------------------------------
@@ -432,30 +605,22 @@ async def portal_leads(req: Request, q: str = "", agent_id: str = ""):
 @router.get("/leads/export.csv", name="portal_leads_export_csv")
 async def portal_leads_export_csv(req: Request, q: str = "", agent_id: str = ""):
     try:
-        client_id = _require_client(req)
+        client_id = await _require_client(req)
     except PermissionError:
         return _redirect(req, "portal_login", flash_kind="error", flash_message="Faça login para acessar.")
 
     q = (q or "").strip()
     agent_id = (agent_id or "").strip()
 
-    with SessionLocal() as db:
-        agents = db.execute(
-            select(Agent).where(Agent.client_id == client_id)
-        ).scalars().all()
-        agents_map = {str(a.id): str(getattr(a, "name", "") or a.id) for a in agents}
-
+    async with AsyncSessionLocal() as db:
         stmt = _build_portal_leads_stmt(client_id=client_id, q=q, agent_id=agent_id, limit=5000)
-        leads = db.execute(stmt).scalars().all()
+        leads = (await db.execute(stmt)).mappings().all()
 
-        rows = [
-            _lead_to_view(l, agent_name=agents_map.get(str(getattr(l, "agent_id", "") or "")))
-            for l in leads
-        ]
+        rows = [_lead_to_view(l) for l in leads]
 
     def _iter_csv():
-        buf = io.StringIO()
-        w = csv.writer(buf, delimiter=";")
+        sink = _CsvChunks()
+        w = csv.writer(sink, delimiter=";")
 
         w.writerow([
             "id", "created_at", "agent_id", "agent_name",
@@ -477,8 +642,11 @@ async def portal_leads_export_csv(req: Request, q: str = "", agent_id: str = "")
                 r.get("intent_detected"),
                 r.get("status"),
             ])
+            if len(sink.buf) >= CSV_CHUNK_ROWS:
+                yield sink.flush()
 
-        yield buf.getvalue()
+        if sink.buf:
+            yield sink.flush()
 
     filename = f"leads_{client_id}_{datetime.now(BR_TZ).strftime('%Y%m%d_%H%M%S')}.csv"
     return StreamingResponse(
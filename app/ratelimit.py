@@ -1,22 +1,71 @@
 import time
-from collections import defaultdict, deque
+import logging
+from array import array
+
+from .redis_client import get_redis
+
+logger = logging.getLogger("agent")
+
+# janela fixa atômica: INCR e, no primeiro evento da janela, PEXPIRE
+_REDIS_RL_SCRIPT = (
+    "local c=redis.call('INCR',KEYS[1]); "
+    "if c==1 then redis.call('PEXPIRE',KEYS[1],ARGV[1]) end; "
+    "return c"
+)
 
 class RateLimiter:
     """
     Limite simples por número: N mensagens por janela (segundos).
+
+    Cada número tem um ring buffer fixo (array de floats) com os timestamps
+    dos últimos N eventos; o slot a ser sobrescrito é sempre o mais antigo.
     """
     def __init__(self, max_events: int = 8, window_seconds: int = 10):
         self.max_events = max_events
         self.window = window_seconds
-        self.events = defaultdict(deque)
+        # key -> [ring de timestamps, head]
+        self.events: dict[str, list] = {}
 
     def allow(self, key: str) -> bool:
+        if self.max_events <= 0:
+            return False
         now = time.time()
-        q = self.events[key]
-        # remove eventos antigos
-        while q and (now - q[0]) > self.window:
-            q.popleft()
-        if len(q) >= self.max_events:
+        slot = self.events.get(key)
+        if slot is None:
+            slot = self.events[key] = [array("d", [0.0]) * self.max_events, 0]
+        ring, head = slot
+        i = head % self.max_events
+        # o evento mais antigo ainda dentro da janela => já há N eventos na janela
+        if (now - ring[i]) <= self.window:
             return False
-        q.append(now)
+        ring[i] = now
+        slot[1] = head + 1
         return True
+
+
+class RedisRateLimiter:
+    """
+    Mesmo limite do RateLimiter, mas compartilhado entre workers via Redis
+    (script Lua carregado uma vez e chamado por EVALSHA).
+    Sem REDIS_URL (ou com Redis fora do ar) usa o RateLimiter em memória.
+    """
+    def __init__(self, max_events: int = 8, window_seconds: int = 10, prefix: str = "rl:"):
+        self.max_events = max_events
+        self.window = window_seconds
+        self.prefix = prefix
+        self.local = RateLimiter(max_events=max_events, window_seconds=window_seconds)
+        self._script = None
+
+    async def allow(self, key: str) -> bool:
+        r = get_redis()
+        if r is None:
+            return self.local.allow(key)
+        try:
+            if self._script is None:
+                # register_script: EVALSHA com recarga automática em NOSCRIPT
+                self._script = r.register_script(_REDIS_RL_SCRIPT)
+            count = await self._script(keys=[f"{self.prefix}{key}"], args=[int(self.window * 1000)])
+            return int(count) <= self.max_events
+        except Exception as e:
+            logger.warning("RATELIMIT_REDIS_ERROR: %s", e)
+            return self.local.allow(key)
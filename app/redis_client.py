@@ -0,0 +1,35 @@
+# app/redis_client.py
+"""
+Cliente Redis (async) compartilhado.
+
+Opcional:
+- só ativa se REDIS_URL estiver definido e o pacote `redis` estiver instalado
+- sem Redis, get_redis() retorna None e quem chama usa o fallback (DB / memória)
+"""
+from __future__ import annotations
+
+import os
+from typing import Any, Optional
+
+try:
+    import redis.asyncio as aioredis
+except Exception:
+    aioredis = None  # type: ignore
+
+REDIS_URL = os.getenv("REDIS_URL", "").strip()
+# timeout curto: Redis fora do ar cai rápido no fallback em vez de esperar o timeout TCP do SO
+REDIS_TIMEOUT_SECONDS = float(os.getenv("REDIS_TIMEOUT_SECONDS", "0.5"))
+
+_client: Optional[Any] = None
+
+
+def get_redis() -> Optional[Any]:
+    global _client
+    if _client is None and REDIS_URL and aioredis is not None:
+        _client = aioredis.from_url(
+            REDIS_URL,
+            decode_responses=True,
+            socket_connect_timeout=REDIS_TIMEOUT_SECONDS,
+            socket_timeout=REDIS_TIMEOUT_SECONDS,
+        )
+    return _client
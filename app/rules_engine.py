@@ -2,13 +2,17 @@
 from __future__ import annotations
 
 import os
-import time
+import re
+import sys
 from dataclasses import dataclass
+from functools import lru_cache
+from threading import Lock
 from typing import Any, Optional
 from datetime import datetime
 
+from cachetools import Cache, LRUCache, TTLCache
 from sqlalchemy import select
-from .db import SessionLocal
+from .db import engine
 from .models import Agent
 
 try:
@@ -17,7 +21,7 @@ except Exception:
     ZoneInfo = None  # type: ignore
 
 
-@dataclass
+@dataclass(slots=True)
 class AgentRules:
     agent_id: str
     client_id: str
@@ -25,35 +29,159 @@ class AgentRules:
     rules: dict
 
 
-# cache simples por agent_id (DEV ok)
-_CACHE: dict[str, tuple[float, dict]] = {}
-_CACHE_TTL_SECONDS = 0  # 0 = sempre reflete mudanças (sem TTL)
+# default compartilhado para `x.get(...) or _EMPTY` (só leitura: nunca alterar)
+_EMPTY: dict = {}
 
-
-def _now() -> float:
-    return time.time()
+# cache por agent_id (TTL curto: edições feitas por outro worker aparecem em até TTL s)
+# RULES_CACHE_TTL_SECONDS=0 => sem expiração (só invalidate_agent_rules); LRUCache não lê o relógio
+_CACHE_TTL_SECONDS = int(os.getenv("RULES_CACHE_TTL_SECONDS", "60"))
+_CACHE: Cache = (
+    TTLCache(maxsize=1024, ttl=_CACHE_TTL_SECONDS) if _CACHE_TTL_SECONDS > 0 else LRUCache(maxsize=1024)
+)
+_CACHE_LOCK = Lock()
 
 
 def load_rules_for_agent(agent_id: str) -> dict:
     if not agent_id:
         return {}
 
-    hit = _CACHE.get(agent_id)
-    if hit:
-        ts, rules = hit
-        if _CACHE_TTL_SECONDS <= 0 or (_now() - ts) <= _CACHE_TTL_SECONDS:
-            return rules
+    with _CACHE_LOCK:
+        hit = _CACHE.get(agent_id)
+    if hit is not None:
+        return hit
 
-    with SessionLocal() as db:
-        a = db.execute(select(Agent).where(Agent.id == agent_id).limit(1)).scalar_one_or_none()
-        rules = (getattr(a, "rules_json", None) or {}) if a else {}
+    # busca fora do lock: um miss lento não trava os hits de outros agentes
+    rules = _fetch_rules(agent_id)
 
-    _CACHE[agent_id] = (_now(), rules)
+    with _CACHE_LOCK:
+        _CACHE[agent_id] = rules
     return rules
 
 
+def _fetch_rules(agent_id: str) -> dict:
+    """
+    Lê rules_json do banco e devolve já normalizado (sem cache).
+    """
+    # leitura pura: Connection (Core) em vez de Session — sem SessionTransaction/identity map;
+    # close() devolve a conexão ao pool
+    conn = engine.connect()
+    try:
+        # só a coluna: sem hidratar a entidade Agent
+        row = conn.execute(select(Agent.rules_json).where(Agent.id == agent_id).limit(1)).first()
+    finally:
+        conn.close()
+    rules = (row[0] or _EMPTY) if row else _EMPTY
+
+    return _normalize_rules(rules)
+
+
 def invalidate_agent_rules(agent_id: str) -> None:
-    _CACHE.pop(agent_id, None)
+    with _CACHE_LOCK:
+        _CACHE.pop(agent_id, None)
+
+
+# -----------------------------------------------------------------------------
+# Normalização (uma vez por carga de rules; campos derivados começam com "_")
+# -----------------------------------------------------------------------------
+def _parse_hhmm(value: Any) -> Optional[int]:
+    try:
+        h, m = str(value).strip().split(":")
+        return int(h) * 60 + int(m)
+    except Exception:
+        return None
+
+
+def _normalize_hours(hours: dict) -> dict:
+    """
+    Pré-calcula o horário comercial em minutos do dia + timezone.
+    open/close inválidos => None (in_business_hours considera aberto).
+    """
+    h = dict(hours)
+    h["_open_min"] = _parse_hhmm(hours.get("open") or "08:00")
+    h["_close_min"] = _parse_hhmm(hours.get("close") or "18:00")
+
+    # timezone: prioridade = rules.hours.timezone > env APP_TIMEZONE > America/Sao_Paulo
+    h["_tz"] = str(hours.get("timezone") or os.getenv("APP_TIMEZONE", "America/Sao_Paulo")).strip() or "America/Sao_Paulo"
+    return h
+
+
+def _hours_active(hours: dict) -> bool:
+    """
+    Só há restrição com mode=business e open/close válidos;
+    se configuraram errado, não derruba atendimento (considera aberto).
+    """
+    if (hours.get("mode") or "").lower() != "business":
+        return False
+    return hours["_open_min"] is not None and hours["_close_min"] is not None
+
+
+def _build_menu_index(menu: dict) -> dict:
+    """
+    menu.options -> {key normalizada: option}. Em key repetida vale a primeira (como no loop antigo).
+    """
+    idx: dict = {}
+    for o in menu.get("options") or ():
+        if not isinstance(o, dict):
+            continue
+        k = str(o.get("key") or "").strip().lower()
+        if k:
+            idx.setdefault(sys.intern(k), o)
+    return idx
+
+
+_MENU_CMDS = frozenset(("menu", "voltar"))
+
+
+def _build_dispatch(rules: dict) -> dict:
+    """
+    Texto normalizado -> ação: ("handoff",), ("cmd",) ou ("opt", option).
+    Em colisão vale a mesma precedência do apply_rules: handoff > menu/voltar > opção.
+    """
+    idx = rules.get("_menu_index")
+    if idx is None:
+        idx = _build_menu_index(rules.get("menu") or _EMPTY)
+    dispatch: dict = {k: ("opt", o) for k, o in idx.items()}
+    for c in _MENU_CMDS:
+        dispatch[c] = ("cmd",)
+    kw = rules.get("_handoff_kw")
+    if kw is None:
+        kw = _handoff_keyword(rules)
+    dispatch[kw] = ("handoff",)
+    return dispatch
+
+
+def _handoff_keyword(rules: dict) -> str:
+    handoff = rules.get("handoff") or _EMPTY
+    return sys.intern((handoff.get("keyword") or "atendente").strip().lower())
+
+
+def _normalize_rules(rules: dict) -> dict:
+    """
+    Copia rasa do rules_json com campos derivados (o JSON original não é alterado).
+    """
+    rules = dict(rules)
+
+    hours = rules.get("hours")
+    if isinstance(hours, dict):
+        rules["hours"] = hours = _normalize_hours(hours)
+        rules["_hours_active"] = _hours_active(hours)
+    else:
+        rules["_hours_active"] = False
+
+    rules["_menu_index"] = _build_menu_index(rules.get("menu") or _EMPTY)
+    rules["_menu_reply_cached"] = _build_menu_reply(rules)
+    rules["_handoff_kw"] = _handoff_keyword(rules)
+    rules["_dispatch"] = _build_dispatch(rules)
+
+    return rules
+
+
+_MISSING = object()
+
+
+@lru_cache(maxsize=256)
+def _split_path(path: str) -> tuple[str, ...]:
+    return tuple(path.split("."))
 
 
 def get_text(d: dict, path: str, default: str = "") -> str:
@@ -61,21 +189,41 @@ def get_text(d: dict, path: str, default: str = "") -> str:
     Helper para ler chaves do JSON: "messages.welcome"
     """
     cur: Any = d
-    for p in path.split("."):
-        if not isinstance(cur, dict) or p not in cur:
+    for p in _split_path(path):
+        if type(cur) is not dict:
+            return default
+        cur = cur.get(p, _MISSING)
+        if cur is _MISSING:
             return default
-        cur = cur[p]
     return cur if isinstance(cur, str) else default
 
 
-def _safe_format(template: str, **kwargs) -> str:
+_PLACEHOLDER_RE = re.compile(r"\{(\w+)\}")
+
+
+@lru_cache(maxsize=128)
+def _compile_template(template: str) -> tuple[str, ...]:
     """
-    Formata placeholders sem quebrar se o template tiver chaves extras.
+    "Olá {nome}!" -> ("Olá ", "nome", "!"): literais nas posições pares, placeholders nas ímpares.
     """
-    try:
-        return template.format(**kwargs)
-    except Exception:
+    return tuple(_PLACEHOLDER_RE.split(template))
+
+
+def _render_template(template: str, **kwargs) -> str:
+    """
+    Substitui {placeholders} sem quebrar: chave desconhecida fica como está no texto.
+    """
+    frags = _compile_template(template)
+    if len(frags) == 1:
         return template
+    out = []
+    for i, frag in enumerate(frags):
+        if i % 2 == 0:
+            out.append(frag)
+        else:
+            v = kwargs.get(frag)
+            out.append(f"{{{frag}}}" if v is None else str(v))
+    return "".join(out)
 
 
 def _now_minutes_in_tz(tzname: str) -> int:
@@ -107,49 +255,53 @@ def in_business_hours(rules: dict) -> bool:
 
     Se não existir hours ou mode != business => considera aberto.
     """
-    hours = rules.get("hours") or {}
-    mode = (hours.get("mode") or "").lower()
-    if mode != "business":
+    # rules vindas de load_rules_for_agent já trazem _hours_active (e hours normalizado)
+    active = rules.get("_hours_active")
+    if active is False:
         return True
 
-    open_h = str(hours.get("open") or "08:00").strip()
-    close_h = str(hours.get("close") or "18:00").strip()
+    hours = rules.get("hours") or _EMPTY
+    if active is None:
+        if "_open_min" not in hours:
+            hours = _normalize_hours(hours)
+        if not _hours_active(hours):
+            return True
 
-    # timezone: prioridade = rules.hours.timezone > env APP_TIMEZONE > America/Sao_Paulo
-    tzname = str(hours.get("timezone") or os.getenv("APP_TIMEZONE", "America/Sao_Paulo")).strip() or "America/Sao_Paulo"
+    open_min = hours["_open_min"]
+    close_min = hours["_close_min"]
 
     # agora em minutos no fuso certo
-    now_min = _now_minutes_in_tz(tzname)
-
-    # parse de "HH:MM"
-    try:
-        oh, om = open_h.split(":")
-        ch, cm = close_h.split(":")
-        open_min = int(oh) * 60 + int(om)
-        close_min = int(ch) * 60 + int(cm)
-    except Exception:
-        # se configuraram errado, não derruba atendimento
-        return True
+    now_min = _now_minutes_in_tz(hours["_tz"])
 
     return open_min <= now_min <= close_min
 
 
 def menu_reply(rules: dict) -> str:
+    """
+    Texto do menu; vem pronto de load_rules_for_agent (_menu_reply_cached).
+    """
+    cached = rules.get("_menu_reply_cached")
+    if cached is not None:
+        return cached
+    return _build_menu_reply(rules)
+
+
+def _build_menu_reply(rules: dict) -> str:
     """
     Mantém o menu atual (baseado em menu.options).
     Se existir ui.menu.fallback_text (novo), usa como texto do menu.
     """
-    ui = rules.get("ui") or {}
+    ui = rules.get("ui") or _EMPTY
     if isinstance(ui, dict):
-        ui_menu = ui.get("menu") or {}
+        ui_menu = ui.get("menu") or _EMPTY
         if isinstance(ui_menu, dict):
             fb = ui_menu.get("fallback_text")
             if isinstance(fb, str) and fb.strip():
                 return fb.strip()
 
-    menu = rules.get("menu") or {}
+    menu = rules.get("menu") or _EMPTY
     title = menu.get("title") or "Menu"
-    opts = menu.get("options") or []
+    opts = menu.get("options") or ()
     lines = [f"*{title}*"]
     for o in opts:
         k = str(o.get("key") or "").strip()
@@ -160,31 +312,78 @@ def menu_reply(rules: dict) -> str:
     return "\n".join(lines)
 
 
-def match_menu_option(rules: dict, text: str) -> Optional[dict]:
+def match_menu_option(rules: dict, text: str, tl: Optional[str] = None) -> Optional[dict]:
     """
     Mantém compatibilidade:
     - primeiro tenta menu.options (antigo)
     - depois tenta menu.map (novo para rowId/buttonId)
+
+    `tl` é o texto já normalizado (strip + lower), quando o chamador já o tem.
     """
-    menu = rules.get("menu") or {}
+    menu = rules.get("menu") or _EMPTY
     t = (text or "").strip()
+    if tl is None:
+        tl = t.lower()
 
-    # 1) antigo: menu.options com key "1/2/3"
-    opts = menu.get("options") or []
-    tl = t.lower()
-    for o in opts:
-        k = str(o.get("key") or "").strip().lower()
-        if k and tl == k:
-            return o
+    # 1) antigo: menu.options com key "1/2/3" (índice pré-montado em load_rules_for_agent)
+    idx = rules.get("_menu_index")
+    if idx is None:
+        idx = _build_menu_index(menu)
+    hit = idx.get(tl)
+    if hit is not None:
+        return hit
 
     # 2) novo opcional: menu.map (ex.: "menu:orcamento" -> reply)
+    return _match_menu_map(menu, t)
+
+
+def _match_menu_map(menu: dict, t: str) -> Optional[dict]:
     mp = menu.get("map")
     if isinstance(mp, dict) and t in mp:
         return {"key": t, "reply": mp.get(t)}
-
     return None
 
 
+def _handle_handoff_collect(t: str, tl: str, state: dict, rules: dict) -> Optional[str]:
+    """
+    Coletando lead pro handoff: espera "Nome - Telefone - Assunto".
+    """
+    nome, sep1, rest = t.partition("-")
+    telefone, sep2, assunto = rest.partition("-")
+    if sep1 and sep2:
+        nome = nome.strip()
+        telefone = telefone.strip()
+        assunto = assunto.strip()
+
+        state["lead"] = {"nome": nome, "telefone": telefone, "assunto": assunto}
+        state["step"] = "lead_captured"
+
+        tpl = get_text(
+            rules,
+            "messages.handoff_ok",
+            "Obrigado, {nome}! ✅ Recebemos suas informações e um atendente vai falar com você em breve.",
+        )
+
+        return _render_template(
+            tpl,
+            nome=nome or "🙂",
+            telefone=telefone or "",
+            assunto=assunto or "",
+        )
+
+    return get_text(
+        rules,
+        "messages.handoff_retry",
+        "Não consegui entender. Envie no formato:\n*Nome* - *Telefone* - *Assunto*",
+    )
+
+
+# state["step"] -> handler(t, tl, state, rules); roda depois de handoff/horário/menu
+_STEP_HANDLERS = {
+    "handoff_collect": _handle_handoff_collect,
+}
+
+
 def apply_rules(number: str, text: str, state: dict, rules: dict) -> Optional[str]:
     """
     Motor genérico:
@@ -198,11 +397,17 @@ def apply_rules(number: str, text: str, state: dict, rules: dict) -> Optional[st
     - menu.map opcional (compatível com selectedRowId/selectedButtonId)
     """
     t = (text or "").strip()
+    tl = t.lower()
+
+    # uma busca só: keyword de handoff, menu/voltar e keys de menu.options
+    dispatch = rules.get("_dispatch")
+    if dispatch is None:
+        dispatch = _build_dispatch(rules)
+    action = dispatch.get(tl)
+    kind = action[0] if action is not None else None
 
     # Handoff keyword (mesmo comportamento)
-    handoff = rules.get("handoff") or {}
-    handoff_kw = (handoff.get("keyword") or "atendente").strip().lower()
-    if t.lower() == handoff_kw:
+    if kind == "handoff":
         state["step"] = "handoff_collect"
         return get_text(
             rules,
@@ -220,42 +425,17 @@ def apply_rules(number: str, text: str, state: dict, rules: dict) -> Optional[st
             )
 
     # Comandos (mesmo comportamento)
-    if t.lower() in ("menu", "voltar"):
+    if kind == "cmd":
         state["step"] = "menu"
         return menu_reply(rules)
 
-    # Se está coletando lead pro handoff
-    if state.get("step") == "handoff_collect":
-        parts = [p.strip() for p in t.split("-")]
-        if len(parts) >= 3:
-            nome = (parts[0] or "").strip()
-            telefone = (parts[1] or "").strip()
-            assunto = "-".join(parts[2:]).strip()
-
-            state["lead"] = {"nome": nome, "telefone": telefone, "assunto": assunto}
-            state["step"] = "lead_captured"
-
-            tpl = get_text(
-                rules,
-                "messages.handoff_ok",
-                "Obrigado, {nome}! ✅ Recebemos suas informações e um atendente vai falar com você em breve.",
-            )
-
-            return _safe_format(
-                tpl,
-                nome=nome or "🙂",
-                telefone=telefone or "",
-                assunto=assunto or "",
-            )
-
-        return get_text(
-            rules,
-            "messages.handoff_retry",
-            "Não consegui entender. Envie no formato:\n*Nome* - *Telefone* - *Assunto*",
-        )
+    # steps com tratamento próprio (ex.: coletando lead pro handoff)
+    handler = _STEP_HANDLERS.get(state.get("step"))
+    if handler is not None:
+        return handler(t, tl, state, rules)
 
     # Menu option (antigo + novo map)
-    opt = match_menu_option(rules, t)
+    opt = action[1] if kind == "opt" else _match_menu_map(rules.get("menu") or _EMPTY, t)
     if opt:
         state["step"] = f"menu:{opt.get('key')}"
 
@@ -1,6 +1,9 @@
 import time
 import json
 import logging
+from typing import Optional
+from collections import OrderedDict
+from threading import Lock
 from sqlalchemy.orm import Session
 from .db import SessionLocal
 from .models import ConversationState
@@ -8,13 +11,24 @@ from sqlalchemy import select
 
 logger = logging.getLogger("agent")
 
+# quantos message_ids lembrar para deduplicação (LRU; os mais antigos saem)
+SEEN_IDS_MAX = 100_000
+
+# locks por conversa em faixas fixas (hash do número): não cresce com o número de contatos
+_STATE_LOCK_STRIPES = 64
+
+_PAUSE_KEY = "bot_paused_until"
+
+
 class MemoryStore:
     _instance = None
 
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(MemoryStore, cls).__new__(cls)
-            cls._instance.seen_ids = set()
+            cls._instance.seen_ids = OrderedDict()
+            cls._instance._seen_lock = Lock()
+            cls._instance._state_locks = tuple(Lock() for _ in range(_STATE_LOCK_STRIPES))
         return cls._instance
 
     def _normalize_number(self, number: str) -> str:
@@ -23,13 +37,21 @@ class MemoryStore:
             return digits[-8:]
         return digits
 
+    def _state_lock(self, number: str) -> Lock:
+        key = self._normalize_number(number)
+        return self._state_locks[hash(key) % _STATE_LOCK_STRIPES]
+
     def seen(self, message_id: str):
         if not message_id:
             return False
-        if message_id in self.seen_ids:
-            return True
-        self.seen_ids.add(message_id)
-        return False
+        with self._seen_lock:
+            if message_id in self.seen_ids:
+                self.seen_ids.move_to_end(message_id)
+                return True
+            self.seen_ids[message_id] = None
+            if len(self.seen_ids) > SEEN_IDS_MAX:
+                self.seen_ids.popitem(last=False)
+            return False
 
     def get_state(self, number: str):
         key = self._normalize_number(number)
@@ -40,22 +62,38 @@ class MemoryStore:
             return {}
 
     def save_state(self, number: str, state: dict):
+        # grava o dict como veio (inclusive bot_paused_until)
+        with self._state_lock(number):
+            self._update_state(number, lambda cur: state)
+
+    # `now` (epoch em segundos) permite ao chamador ler o relógio uma vez por request
+    def set_paused(self, number: str, seconds: int, now: Optional[int] = None):
+        if now is None:
+            now = int(time.time())
+        until = now + int(seconds)
+        with self._state_lock(number):
+            self._update_state(number, lambda cur: {**cur, _PAUSE_KEY: until})
+
+    def _update_state(self, number: str, fn):
+        """
+        Lê -> fn(state atual) -> grava, numa transação com a linha travada (FOR UPDATE),
+        então também fica serializado entre workers.
+        """
         key = self._normalize_number(number)
         with SessionLocal() as db:
-            row = db.execute(select(ConversationState).where(ConversationState.id == key)).scalar_one_or_none()
+            row = db.execute(
+                select(ConversationState).where(ConversationState.id == key).with_for_update()
+            ).scalar_one_or_none()
             if not row:
                 row = ConversationState(id=key)
                 db.add(row)
-            
-            row.state_json = state
-            db.commit()
 
-    def set_paused(self, number: str, seconds: int):
-        state = self.get_state(number)
-        state["bot_paused_until"] = int(time.time()) + int(seconds)
-        self.save_state(number, state)
+            row.state_json = fn(dict(row.state_json or {}))
+            db.commit()
 
-    def is_paused(self, number: str) -> bool:
+    def is_paused(self, number: str, now: Optional[int] = None) -> bool:
+        if now is None:
+            now = int(time.time())
         state = self.get_state(number)
-        until = int(state.get("bot_paused_until") or 0)
-        return int(time.time()) < until
+        until = int(state.get(_PAUSE_KEY) or 0)
+        return now < until
@@ -0,0 +1,6 @@
+import hmac
+
+
+def token_matches(expected: str, given: str) -> bool:
+    # comparação em tempo constante (não vaza o tamanho do prefixo correto)
+    return hmac.compare_digest(expected.encode("utf-8"), given.encode("utf-8"))
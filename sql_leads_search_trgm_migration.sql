@@ -0,0 +1,12 @@
+-- busca do portal (ILIKE '%q%' em várias colunas, combinadas com OR)
+-- índices trigram GIN permitem ao Postgres usar BitmapOr em vez de seqscan.
+-- todas as colunas do OR precisam de índice, senão o planner volta ao seqscan.
+
+create extension if not exists pg_trgm;
+
+create index if not exists idx_leads_from_number_trgm on leads using gin (from_number gin_trgm_ops);
+create index if not exists idx_leads_nome_trgm on leads using gin (nome gin_trgm_ops);
+create index if not exists idx_leads_telefone_trgm on leads using gin (telefone gin_trgm_ops);
+create index if not exists idx_leads_assunto_trgm on leads using gin (assunto gin_trgm_ops);
+create index if not exists idx_leads_instance_trgm on leads using gin (instance gin_trgm_ops);
+create index if not exists idx_leads_agent_id_trgm on leads using gin (agent_id gin_trgm_ops);
@@ -0,0 +1,6 @@
+-- índices compostos usados pelo portal do cliente
+-- (filtro por client_id + GROUP BY agent_id / ORDER BY created_at DESC)
+-- leads (client_id, created_at desc) já existe: idx_leads_client_created em sql_leads_migration.sql
+
+create index if not exists idx_leads_client_agent on leads (client_id, agent_id);
+create index if not exists idx_agents_client_created on agents (client_id, created_at desc);